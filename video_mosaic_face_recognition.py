@@ -15,16 +15,20 @@ pip install moviepy
 
 import sys
 import os
+import json
 import cv2
 import numpy as np
 import imageio
 import face_recognition
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtWidgets import (QApplication,QLabel,QMainWindow,QVBoxLayout,QWidget,QPushButton,QFileDialog,QHBoxLayout,)
+from PyQt5.QtWidgets import (QApplication,QLabel,QMainWindow,QVBoxLayout,QWidget,QPushButton,QFileDialog,QHBoxLayout,QSpinBox,)
 from PIL import Image
 from moviepy.editor import ImageSequenceClip
 
+# Faces are analyzed on every ANALYSIS_STEP-th frame and the results are reused for the frames in between
+ANALYSIS_STEP = 3
+
 # Get a list of file paths in the specified folder
 def get_files_in_folder(folder_path):
     try:
@@ -40,17 +44,18 @@ def user_mosaic(image, location):
     
     return image
 # Apply the mosaic effect to regions other than the identified person in the image
-def others_mosaic(image, location):
+def others_mosaic(image, location, strength=20):
     """
     This function takes an input image and the location of an identified person.
     It applies a mosaic effect to regions other than the identified person's location and returns the modified image.
+    `strength` is the number of mosaic blocks across the face width; smaller values give coarser blocks.
     """
     result_image = image.copy()
     top, right, bottom, left = location
     width = right - left + 1
     height = bottom - top + 1
     
-    window_size = width // 20
+    window_size = max(width // strength, 1)
     xstep = width // window_size
     ystep = height // window_size
     
@@ -65,12 +70,13 @@ def others_mosaic(image, location):
     return result_image
 
 # Analysis results of a single frame and apply them to the remaining two frames
-def process_point_frame(image, folder_path):
+def process_point_frame(image, folder_path, strength=20):
     """
     Analyzes the input frame, identifies faces, and applies mosaic effects based on known face encodings.
     Args:
         image (numpy.ndarray): The input frame image.
         folder_path (str): The path to the folder containing known face images.
+        strength (int): The number of mosaic blocks across a face.
     Returns:
         tuple: A tuple containing the processed image, face locations, 
         and a list of booleans indicating whether each face was identified.
@@ -96,23 +102,64 @@ def process_point_frame(image, folder_path):
             result_image = user_mosaic(result_image, unknown_face_location)
             similarities.append(True)
         else:
-            result_image = others_mosaic(result_image, unknown_face_location)
+            result_image = others_mosaic(result_image, unknown_face_location, strength)
             similarities.append(False)
 
     return result_image, unknown_face_locations, similarities
 
 # Transform the analyzed results into images for the remaining two frames
-def process_other_frame(image, face_locations, similarities):
+def process_other_frame(image, face_locations, similarities, strength=20):
     result_image = image.copy()
 
     for face_location, similarity in zip(face_locations, similarities):
         if similarity:
             result_image = user_mosaic(result_image, face_location)
         else:
-            result_image = others_mosaic(result_image, face_location)
+            result_image = others_mosaic(result_image, face_location, strength)
 
     return result_image
 
+# Intersection over union of two (top, right, bottom, left) face boxes
+def box_iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+# Give each face a track ID by matching it to the faces of the previous analyzed frame
+def assign_track_ids(face_locations, previous_faces, next_track_id, threshold=0.3):
+    """
+    Greedily matches the new face locations to the previous analyzed frame by box overlap.
+    Args:
+        face_locations (list): Face locations (top, right, bottom, left) of the current frame.
+        previous_faces (list): Face records ({"id", "box"}) of the previous analyzed frame.
+        next_track_id (int): The ID to give to the next face that starts a new track.
+    Returns:
+        tuple: A tuple containing the list of track IDs and the updated next track ID.
+    """
+    track_ids = []
+    used = set()
+
+    for location in face_locations:
+        best_id, best_iou = None, threshold
+        for face in previous_faces:
+            if face["id"] in used:
+                continue
+            iou = box_iou(location, face["box"])
+            if iou >= best_iou:
+                best_id, best_iou = face["id"], iou
+
+        if best_id is None:
+            best_id = next_track_id
+            next_track_id += 1
+        used.add(best_id)
+        track_ids.append(best_id)
+
+    return track_ids, next_track_id
+
 # Convert a video to a list of frames along with its frames per second (fps) information
 def video_to_frames(video_path):
     frames = []
@@ -124,20 +171,129 @@ def video_to_frames(video_path):
 
     return frames, fps
 
-# Process a list of frames by analyzing every third frame and applying the results to the remaining two frames
-def process_frames(frames, folder_path):
+# Process a list of frames by analyzing every ANALYSIS_STEP-th frame and applying the results to the frames in between
+def process_frames(frames, folder_path, strength=20):
+    """
+    Returns the processed frames together with the annotations of every analyzed frame,
+    so the analysis can be saved with save_annotations and re-rendered without detection.
+    """
     result = []
+    annotations = []
     face_locations = []
     similarities = []
+    faces = []
+    next_track_id = 0
 
     for idx, frame in enumerate(frames):
-        if idx % 3 == 0:
-            f, face_locations, similarities = process_point_frame(frame, folder_path)
+        if idx % ANALYSIS_STEP == 0:
+            f, face_locations, similarities = process_point_frame(frame, folder_path, strength)
+            track_ids, next_track_id = assign_track_ids(face_locations, faces, next_track_id)
+            faces = [
+                {"id": track_id, "box": list(location), "known": similarity}
+                for track_id, location, similarity in zip(track_ids, face_locations, similarities)
+            ]
+            annotations.append({"frame": idx, "faces": faces})
             result.append(f)
         else:
-            f = process_other_frame(frame, face_locations, similarities)
+            f = process_other_frame(frame, face_locations, similarities, strength)
             result.append(f)
 
+    return result, annotations
+
+# Save the analysis results as a JSON lines file: a header line, then one line per analyzed frame
+def save_annotations(annotations, annotation_path, fps, frame_count, source_path, step=ANALYSIS_STEP):
+    """
+    The header's "overrides" object maps track IDs to known flags and is applied on re-rendering,
+    so a face can be unmasked or masked for the whole track by editing a single entry.
+    """
+    with open(annotation_path, 'w', encoding='utf-8') as f:
+        header = {"source": source_path, "fps": fps, "frame_count": frame_count, "step": step, "overrides": {}}
+        f.write(json.dumps(header) + '\n')
+        for record in annotations:
+            f.write(json.dumps(record) + '\n')
+
+# Load a JSON lines annotation file written by save_annotations
+def load_annotations(annotation_path):
+    """
+    Reads and validates an annotation file.
+    Returns:
+        tuple: A tuple containing the header, the per-frame records,
+        and the overrides as a mapping of int track ID to known flag.
+    Raises:
+        ValueError: If the file is empty, not JSON, or missing required fields.
+    """
+    with open(annotation_path, 'r', encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+
+    if not lines:
+        raise ValueError("The annotation file is empty.")
+
+    header = json.loads(lines[0])
+    if not isinstance(header, dict) or not all(key in header for key in ("source", "fps", "frame_count")):
+        raise ValueError("The annotation header must contain source, fps and frame_count.")
+    if not isinstance(header["fps"], (int, float)) or not isinstance(header["frame_count"], int):
+        raise ValueError("The annotation header's fps and frame_count must be numbers.")
+    if not isinstance(header.get("overrides", {}), dict):
+        raise ValueError("The annotation header's overrides must be an object.")
+
+    annotations = [json.loads(line) for line in lines[1:]]
+    for record in annotations:
+        if not isinstance(record, dict) or "frame" not in record or "faces" not in record:
+            raise ValueError("Every annotation record must contain frame and faces.")
+        if not is_int(record["frame"]) or not isinstance(record["faces"], list):
+            raise ValueError("Every annotation record must have an int frame and a list of faces.")
+        for face in record["faces"]:
+            if not is_valid_face(face):
+                raise ValueError(f"Invalid face in frame {record['frame']}: it must have an int id, "
+                                 "a box of 4 ints and a true/false known flag.")
+
+    # JSON object keys are strings, so convert them back to int track IDs.
+    # Only real booleans are accepted, so a mistyped value never unmasks a face.
+    overrides = {}
+    for track_id, known in header.get("overrides", {}).items():
+        if not isinstance(known, bool):
+            raise ValueError(f"The override of track {track_id} must be true or false.")
+        overrides[int(track_id)] = known
+    return header, annotations, overrides
+
+# Check that a value is an int from JSON (bool is a subclass of int, so it is excluded)
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# Check that a face record has an int id, a (top, right, bottom, left) box of 4 ints and a bool known flag
+def is_valid_face(face):
+    return (isinstance(face, dict)
+            and is_int(face.get("id"))
+            and isinstance(face.get("box"), list) and len(face["box"]) == 4
+            and all(is_int(value) for value in face["box"])
+            and isinstance(face.get("known"), bool))
+
+# Apply mosaics from saved annotations without running face detection
+def render_frames(frames, annotations, strength=20, overrides=None):
+    """
+    Re-renders the frames from saved annotations. Each annotation holds until the next analyzed frame.
+    Args:
+        frames (list): The source video frames.
+        annotations (list): Per-frame records ({"frame", "faces"}) loaded with load_annotations.
+        strength (int): The number of mosaic blocks across a face.
+        overrides (dict): Optional mapping of track ID to known flag, replacing the saved flag
+            (the header's "overrides" object, as returned by load_annotations).
+    Returns:
+        list: The processed frames.
+    """
+    overrides = overrides or {}
+    by_frame = {record["frame"]: record["faces"] for record in annotations}
+    result = []
+    face_locations = []
+    similarities = []
+
+    for idx, frame in enumerate(frames):
+        if idx in by_frame:
+            faces = by_frame[idx]
+            face_locations = [tuple(face["box"]) for face in faces]
+            similarities = [overrides.get(face["id"], face["known"]) for face in faces]
+        result.append(process_other_frame(frame, face_locations, similarities, strength))
+
     return result
 
 # Conver a list of frames to a video
@@ -229,12 +385,28 @@ class MediaViewer(QMainWindow):
         self.convert_button.setFont(font)
         self.buttons_layout.addWidget(self.convert_button)
 
+        self.render_button = QPushButton("Render from annotations", self.central_widget)
+        self.render_button.clicked.connect(self.render_function)
+        font = self.render_button.font()
+        font.setPointSize(14)
+        self.render_button.setFont(font)
+        self.buttons_layout.addWidget(self.render_button)
+
+        # Mosaic strength (number of blocks across a face) used by both Convert and Render
+        self.strength_spinbox = QSpinBox(self.central_widget)
+        self.strength_spinbox.setRange(2, 50)
+        self.strength_spinbox.setValue(20)
+        self.strength_spinbox.setPrefix("Mosaic blocks: ")
+        self.strength_spinbox.setFixedSize(200, 40)
+        self.buttons_layout.addWidget(self.strength_spinbox)
+
         self.load_image_button.setFixedSize(150, 30)
         self.load_video_button.setFixedSize(150, 30)
         self.convert_button.setFixedSize(150, 30)
         self.load_image_button.setFixedSize(200, 40)
         self.load_video_button.setFixedSize(200, 40)
         self.convert_button.setFixedSize(200, 40)
+        self.render_button.setFixedSize(250, 40)
 
         self.buttons_layout.setAlignment(Qt.AlignCenter)
 
@@ -327,7 +499,7 @@ class MediaViewer(QMainWindow):
         """
         Perform the conversion process by applying mosaic to the faces in the video.
         """
-        global video_path, folder_path, output_video_path
+        global video_path, folder_path, output_video_path, output_annotation_path
 
         if not video_path or not folder_path:
             error_message = "Error: Both video and image folder paths must be correctly specified."
@@ -338,7 +510,8 @@ class MediaViewer(QMainWindow):
         self.show_conversion_progress("Conversion in progress")
 
         frames, fps = video_to_frames(video_path)
-        processed_frames = process_frames(frames, folder_path)
+        processed_frames, annotations = process_frames(frames, folder_path, self.strength_spinbox.value())
+        save_annotations(annotations, output_annotation_path, fps, len(frames), video_path, ANALYSIS_STEP)
 
         # 수정된 코드: 처리된 비디오로 변환 및 output_video_path 출력
         frames_to_video(processed_frames, output_video_path, fps)
@@ -348,6 +521,52 @@ class MediaViewer(QMainWindow):
         self.save_first_frame(output_video_path)
 
         print("Conversion completed!")
+        print("Annotations saved:", output_annotation_path)
+
+    # Re-render the mosaic video from a saved annotation file without face detection
+    def render_function(self):
+        global video_path, output_video_path
+
+        annotation_path, _ = QFileDialog.getOpenFileName(
+            self, "Select Annotation File", "", "Annotation Files (*.jsonl);;All Files (*)"
+        )
+        if not annotation_path:
+            return
+
+        try:
+            header, annotations, overrides = load_annotations(annotation_path)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            error_message = f"Error: Unable to read the annotation file ({e})."
+            self.show_conversion_progress(error_message)
+            print(error_message)
+            return
+
+        # Prefer the video the annotations were made from, and fall back to the loaded video
+        source_path = header["source"]
+        if not source_path or not os.path.exists(source_path):
+            source_path = video_path
+        if not source_path or not os.path.exists(source_path):
+            error_message = "Error: The source video of the annotations could not be found."
+            self.show_conversion_progress(error_message)
+            print(error_message)
+            return
+
+        self.show_conversion_progress("Rendering in progress")
+
+        frames, fps = video_to_frames(source_path)
+        if len(frames) != header["frame_count"] or abs(fps - header["fps"]) > 0.01:
+            error_message = f"Error: The annotations do not match the video {source_path}."
+            self.show_conversion_progress(error_message)
+            print(error_message)
+            return
+
+        processed_frames = render_frames(frames, annotations, self.strength_spinbox.value(), overrides)
+        frames_to_video(processed_frames, output_video_path, fps)
+        self.show_conversion_progress(f"Rendering completed - Output Video Path: {output_video_path}")
+
+        self.save_first_frame(output_video_path)
+
+        print("Rendering completed!")
 
     # Save and display the first frame
     def save_first_frame(self, video_path):
@@ -380,6 +599,7 @@ class MediaViewer(QMainWindow):
 video_path = ''
 folder_path = ""
 output_video_path = 'result_video.mp4'
+output_annotation_path = 'result_annotations.jsonl'
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)